@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 import argparse
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
+import hashlib
 import lsb_release
 import os
+import re
 import subprocess
 import sys
+import tarfile
+import threading
 from tempfile import TemporaryDirectory as tempdir
 import yaml
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 import apt
 import apt.debfile
+import apt.progress.base
+import apt_pkg
 import git
 
 DOC_DIRS = ["/usr/share/doc", "/usr/share/man"]
@@ -41,12 +54,17 @@ LIBS_DIRS = [
     "/lib",
     "/lib32",
     "/lib64",
+    "/libx32",
     "/usr/lib",
     "/usr/lib32",
     "/usr/lib64",
+    "/usr/libexec",
+    "/usr/libx32",
     "/usr/local/lib",
     "/usr/local/lib32",
     "/usr/local/lib64",
+    "/usr/local/libexec",
+    "/usr/local/libx32",
 ]
 BIN_DIRS = [
     "/bin",
@@ -63,185 +81,474 @@ FILE_TYPES = {
     "libs": (LIBS_DIRS, []),
     "bins": (BIN_DIRS, []),
 }
+
+
+def compile_dir_re(dirs: list[str]) -> re.Pattern:
+    """Compiles a regex matching the given directories and anything below them"""
+    return re.compile("(?:%s)(?:/|$)" % "|".join(map(re.escape, dirs)))
+
+
+FILTER_RE = compile_dir_re(FILTER_DIRS)
+FILE_TYPE_RES = {
+    file_type: compile_dir_re(dirs) for file_type, (dirs, _) in FILE_TYPES.items()
+}
+FILE_TYPE_SUFFICES = {
+    file_type: tuple(suffices) for file_type, (_, suffices) in FILE_TYPES.items()
+}
+SLICE_NAMES = ("copyright", *FILE_TYPES, "rest")
+COPYRIGHT_SLICE = SLICE_NAMES.index("copyright")
+REST_SLICE = SLICE_NAMES.index("rest")
+FILE_TYPE_MATCHERS = [
+    (SLICE_NAMES.index(file_type), FILE_TYPE_RES[file_type], suffices)
+    for file_type, suffices in FILE_TYPE_SUFFICES.items()
+]
 INTERDEPENDENT_DEFAULT = {
     "package": ["copyright"],
     "libs": ["depends_libs"],
     "bins": ["libs", "config", "depends_libs"],
 }
 
-cache = apt.Cache()
-temp_dir = tempdir()
+APT_ARCHIVES_DIR = "/var/cache/apt/archives"
+# number of packages fetched and parsed ahead of the one being printed
+FETCH_LOOKAHEAD = 4
+AR_MAGIC = b"!<arch>\n"
+AR_HEADER_SIZE = 60
+TAR_TYPES = {
+    tarfile.DIRTYPE: "d",
+    tarfile.SYMTYPE: "l",
+    tarfile.LNKTYPE: "h",
+}
+
+# opening the apt cache and creating the temporary directory are deferred
+# until they are first needed, see get_cache() and get_temp_dir()
+cache = None
+# apt.Cache is not thread-safe, serialize every access to it, as well as the
+# creation of the temporary directory
+cache_lock = threading.Lock()
+temp_dir = None
+# the packages whose slices are printed in this run
+pkgs_to_slice = frozenset()
+
 
+def get_cache() -> apt.Cache:
+    global cache
+    if cache is None:
+        cache = apt.Cache(progress=None)
+    return cache
 
-class TopLevelEmptyLineDumper(yaml.Dumper):
+
+def get_temp_dir() -> str:
+    global temp_dir
+    if temp_dir is None:
+        temp_dir = tempdir()
+    return temp_dir.name
+
+
+def single_flight(func):
+    """Caches `func` like functools.lru_cache, but computes each result once
+
+    Concurrent calls with the same arguments wait for the call that is already
+    running instead of computing the result again.
+    """
+    results = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with lock:
+            future = results.get(args)
+            is_owner = future is None
+            if is_owner:
+                future = results[args] = Future()
+        if is_owner:
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    return wrapper
+
+
+class TopLevelEmptyLineDumper(yaml.SafeDumper):
     def write_line_break(self, data=None):
         super().write_line_break(data)
         if len(self.indents) == 1:
             super().write_line_break()
 
 
-def find_depends(pkg_name):
-    pkg = cache.get(pkg_name)
-    if pkg is None:
-        print(f"Package {pkg_name} not found")
-        return []
-    pkg: apt.Version = pkg.candidate
-    depends = [dep.name for base_dep in pkg.get_dependencies("PreDepends") for dep in base_dep]
-    depends.extend([
-        dep.name for base_dep in pkg.get_dependencies("Depends") for dep in base_dep
-    ])
-    return depends
+class SliceContents(list):
+    """The paths of a slice, dumped as a YAML mapping with empty values"""
 
+    __slots__ = ()
 
-def find_full_depends(pkg_name):
-    all_deps = set()
 
-    def _do_find_full_depends(pkg_name):
-        nonlocal all_deps
-        deps = find_depends(pkg_name)
-        for dep in deps:
-            if dep not in all_deps:
-                all_deps.add(dep)
-                _do_find_full_depends(dep)
+def represent_none(dumper: yaml.Dumper, _):
+    return dumper.represent_scalar("tag:yaml.org,2002:null", "")
 
-    _do_find_full_depends(pkg_name)
-    return sorted(all_deps)
 
-
-def fetch_pkg(pkg_name) -> os.PathLike:
-    pkg = cache.get(pkg_name)
-    if pkg is None:
-        print(f"Package {pkg_name} not found")
-        return
-    pkg: apt.Version = pkg.candidate
-    return pkg.fetch_binary(temp_dir.name)
+def represent_ordereddict(dumper: yaml.Dumper, data: OrderedDict):
+    return dumper.represent_mapping("tag:yaml.org,2002:map", data.items())
 
 
-def get_dpkg_file_list(pkg_path: os.PathLike) -> list:
-    result = subprocess.run(
-        ["dpkg", "-c", pkg_path], capture_output=True, text=True, check=True
+def represent_slice_contents(dumper: yaml.Dumper, data: SliceContents):
+    return dumper.represent_mapping(
+        "tag:yaml.org,2002:map", ((path, None) for path in data)
     )
-    file_list = result.stdout.splitlines()
-    return file_list
 
 
-def split_dpkg_file_list(files: list[str]):
-    split_files = [file.split() for file in files]
-    return [tuple([file[0], *file[5:]]) for file in split_files]
+TopLevelEmptyLineDumper.add_representer(type(None), represent_none)
+TopLevelEmptyLineDumper.add_representer(OrderedDict, represent_ordereddict)
+TopLevelEmptyLineDumper.add_representer(SliceContents, represent_slice_contents)
+
+
+@functools.lru_cache(maxsize=None)
+def find_depends(pkg_name) -> tuple[str]:
+    with cache_lock:
+        pkg = get_cache().get(pkg_name)
+        if pkg is None:
+            print(f"Package {pkg_name} not found")
+            return ()
+        pkg: apt.Version = pkg.candidate
+        # `dependencies` holds both the PreDepends and the Depends
+        return tuple(dep.name for or_dep in pkg.dependencies for dep in or_dep)
 
 
-def filter_dpkg_file_list(files: list[list[str]]):
-    # filter out directories
-    files = [file for file in files if not "d" in file[0]]
-    # filter out documents
-    for doc_dir in FILTER_DIRS:
-        files = [
-            file for file in files if not doc_dir in file[1] or "copyright" in file[1]
+def find_full_depends(pkg_name):
+    seen = {pkg_name}
+    queue = deque([pkg_name])
+    while queue:
+        for dep in find_depends(queue.popleft()):
+            if dep not in seen:
+                seen.add(dep)
+                queue.append(dep)
+    seen.discard(pkg_name)
+    return sorted(seen)
+
+
+def is_same_file(path: os.PathLike, size: int, sha256: str) -> bool:
+    if not os.path.isfile(path) or os.path.getsize(path) != size:
+        return False
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest() == sha256
+
+
+def find_archived_pkg(
+    filenames: list[str], size: int, sha256: str
+) -> os.PathLike | None:
+    """Returns the path of the package in the local apt archives, if any
+
+    Args:
+        filenames (list[str]): the possible file names of the .deb
+        size (int): the expected size of the .deb
+        sha256 (str): the expected SHA256 checksum of the .deb
+    """
+    if not sha256:
+        return None
+    for filename in filenames:
+        path = os.path.join(APT_ARCHIVES_DIR, filename)
+        if is_same_file(path, size, sha256):
+            return path
+    return None
+
+
+def download_pkg(
+    uri: str, dest: str, size: int, hashes: apt_pkg.HashStringList
+) -> os.PathLike:
+    """Downloads a .deb to `dest` like Version.fetch_binary does
+
+    Unlike fetch_binary, this only takes the values resolved from the apt
+    cache beforehand and uses its own apt_pkg.Acquire, so it does not need
+    to hold `cache_lock`. apt verifies the download against `hashes`.
+
+    Args:
+        uri (str): the URI of the .deb
+        dest (str): the path to download the .deb to
+        size (int): the expected size of the .deb
+        hashes (apt_pkg.HashStringList): the hashes of the package record
+    """
+    acquire = apt_pkg.Acquire(apt.progress.base.AcquireProgress())
+    acquire_file = apt_pkg.AcquireFile(
+        acquire, uri, hashes, size, os.path.basename(dest), destfile=dest
+    )
+    acquire.run()
+    if acquire_file.status != acquire_file.STAT_DONE:
+        error = acquire_file.error_text
+        raise apt.package.FetchError(f"Failed to fetch {uri}: {error}")
+    return dest
+
+
+@single_flight
+def fetch_pkg(pkg_name) -> os.PathLike:
+    # this runs on the worker threads, so it is left to the caller to report
+    # packages that are not found
+    with cache_lock:
+        pkg = get_cache().get(pkg_name)
+        if pkg is None:
+            return
+        pkg: apt.Version = pkg.candidate
+        # apt stores downloaded packages as <name>_<version>_<arch>.deb with
+        # the epoch colon escaped, the pool file name has no epoch at all
+        filenames = [
+            os.path.basename(pkg.filename),
+            f"{pkg.package.shortname}_{pkg.version.replace(':', '%3a')}"
+            f"_{pkg.architecture}.deb",
         ]
-    files = [tuple(file[1:]) for file in files]
-    return sorted(files, key=lambda x: x[0])
+        # the same checks and hashes Version.fetch_binary uses
+        allow_unauthenticated = apt_pkg.config.find_b(
+            "APT::Get::AllowUnauthenticated", False
+        )
+        if not pkg.is_trusted and not allow_unauthenticated:
+            raise apt.package.UntrustedError(
+                f"Could not fetch {pkg_name} from an untrusted source"
+            )
+        uri, size, sha256 = pkg.uri, pkg.size, pkg.sha256
+        hashes = pkg._records.hashes
+        dest = os.path.join(get_temp_dir(), filenames[0])
 
+    pkg_path = find_archived_pkg(filenames, size, sha256)
+    if pkg_path is not None:
+        return pkg_path
+
+    return download_pkg(uri, dest, size, hashes)
 
-def get_file_by_type(files: list[tuple[str]], dirs: list[str], suffices: list[str]):
-    file_set = set()
-    if not suffices:
-        for dir in dirs:
-            file_set.update([file for file in files if dir in file[0]])
-        rest_files = [file for file in files if file not in file_set]
-    else:
-        for dir in dirs:
-            for suffix in suffices:
-                file_set.update(
-                    [
-                        file
-                        for file in files
-                        if dir in file[0] or file[0].endswith(suffix)
-                    ]
-                )
-        rest_files = [file for file in files if file not in file_set]
-    return file_set, rest_files
-
-
-def get_copyright_files(files: list[tuple[str]]):
-    file_set = set()
-    file_set.update([file for file in files if "copyright" in file[0]])
-    rest_files = [file for file in files if file not in file_set]
-    return file_set, rest_files
+
+def find_deb_data_member(deb_file) -> str:
+    """Seeks `deb_file` to the start of its data.tar.* ar member
+
+    Args:
+        deb_file: the .deb file opened in binary mode
+
+    Returns:
+        str: the member name
+    """
+    if deb_file.read(len(AR_MAGIC)) != AR_MAGIC:
+        raise ValueError(f"{deb_file.name} is not a Debian package")
+    while header := deb_file.read(AR_HEADER_SIZE):
+        if len(header) < AR_HEADER_SIZE:
+            break
+        name = header[:16].decode().strip().rstrip("/")
+        size = int(header[48:58])
+        if name.startswith("data.tar"):
+            return name
+        # ar members are aligned to even offsets
+        deb_file.seek(size + size % 2, os.SEEK_CUR)
+    raise ValueError(f"No data.tar member found in {deb_file.name}")
+
+
+def iter_tar_entries(tar: tarfile.TarFile):
+    for info in tar:
+        yield (
+            TAR_TYPES.get(info.type, "-"),
+            # tar members are relative, e.g. "./usr/bin/foo"
+            "/" + info.name.removeprefix("./"),
+            info.linkname if info.issym() else None,
+        )
+
+
+def iter_dpkg_file_list(pkg_path: os.PathLike):
+    """Yields `(type, path, link_target)` for every entry of the package
+
+    This reads the data.tar.* member of the .deb directly instead of parsing
+    the output of `dpkg -c`. `type` is "d" for directories, "l" for symlinks,
+    "h" for hard links and "-" otherwise. `link_target` is only set for
+    symlinks.
+
+    Args:
+        pkg_path (os.PathLike): the path to the .deb file
+    """
+    with open(pkg_path, "rb") as deb_file:
+        name = find_deb_data_member(deb_file)
+        if not name.endswith(".zst"):
+            with tarfile.open(fileobj=deb_file, mode="r|*") as tar:
+                yield from iter_tar_entries(tar)
+            return
+        if zstandard is not None:
+            reader = zstandard.ZstdDecompressor().stream_reader(deb_file)
+            with reader, tarfile.open(fileobj=reader, mode="r|") as tar:
+                yield from iter_tar_entries(tar)
+            return
+
+    # tarfile cannot decompress zstd on its own, let dpkg-deb do it
+    cmd = ["dpkg-deb", "--fsys-tarfile", pkg_path]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                yield from iter_tar_entries(tar)
+            # drain the padding after the end of the archive so that dpkg-deb
+            # does not fail writing to a closed pipe
+            while proc.stdout.read(1 << 16):
+                pass
+        except tarfile.TarError:
+            # a truncated stream is reported below if dpkg-deb failed
+            if proc.wait() == 0:
+                raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def classify_file(dirname: str, basename: str) -> int:
+    """Returns the index in SLICE_NAMES of the slice a (filtered) file belongs to"""
+    if "copyright" in basename or "copyright" in dirname:
+        return COPYRIGHT_SLICE
+    for index, dirs_re, suffices in FILE_TYPE_MATCHERS:
+        if dirs_re.match(dirname) or (suffices and basename.endswith(suffices)):
+            return index
+    return REST_SLICE
+
+
+def get_file_path(file: tuple[str]) -> str:
+    return f"{file[0]}/{file[1]}"
+
+
+def format_file(file: tuple[str]) -> str:
+    """Formats a file as `path` or `path -> link_target` for symlinks"""
+    if len(file) > 2:
+        return f"{get_file_path(file)} -> {file[2]}"
+    return get_file_path(file)
 
 
 def pretty_print_files(
-    files: list[tuple[str]], keep_symbol=False, keep_dst=False, newline_after=True
+    files: list[tuple[str]],
+    keep_symbol=False,
+    keep_dst=False,
+    newline_after=True,
+    already_sorted=False,
 ):
     if keep_symbol and not keep_dst:
-        files = sorted([file[0] for file in files])
+        files = [get_file_path(file) for file in files]
     elif keep_dst and not keep_symbol:
-        files = sorted([file[-1] for file in files])
+        files = [file[2] if len(file) > 2 else get_file_path(file) for file in files]
+        # the input is sorted by path, not by link destination
+        already_sorted = False
     elif not keep_symbol and not keep_dst:
-        files = sorted([" ".join(file) for file in files])
+        files = [format_file(file) for file in files]
     else:
         sys.stderr.write("Invalid combination of keep_symbol and keep_dst")
-    for file in files:
-        print(file)
+        return
+    if not already_sorted:
+        files.sort()
     if newline_after:
-        print()
+        files.append("")
+    if files:
+        sys.stdout.write("\n".join(files) + "\n")
+
+
+def iter_classified_files(files):
+    """Yields `(slice_index, dirname, basename, link_target)` for every file
+
+    Directories and documentation (except copyright files) are dropped.
+    `slice_index` is the index in SLICE_NAMES of the slice of the file.
+
+    Args:
+        files: an iterable of `(type, path, link_target)` package entries, e.g.
+            the generator returned by `iter_dpkg_file_list`
+    """
+    for entry_type, path, link in files:
+        # filter out directories
+        if "d" in entry_type:
+            continue
+        dirname, basename = path.rsplit("/", 1)
+        # filter out documents
+        if FILTER_RE.match(dirname) and "copyright" not in path:
+            continue
+        yield classify_file(dirname, basename), dirname, basename, link
 
 
-def get_file_list_tokens(pkg_name: str):
+def parse_file_list(files) -> OrderedDict[str, list[tuple[str]]]:
+    """Filters the package entries and sorts them into slices in a single pass
+
+    See `iter_classified_files` for the files that are kept. Files are stored
+    as `(dirname, basename)` or `(dirname, basename, link_target)` with the
+    directory names interned, as they are shared by many files. The files of
+    every slice are sorted by path.
+
+    Args:
+        files: an iterable of `(type, path, link_target)` package entries, e.g.
+            the generator returned by `iter_dpkg_file_list`
+
+    Returns:
+        OrderedDict[str, list[tuple[str]]]: the files of each slice
+    """
+    buckets = [[] for _ in SLICE_NAMES]
+    for index, dirname, basename, link in iter_classified_files(files):
+        dirname = sys.intern(dirname)
+        buckets[index].append(
+            (dirname, basename, link) if link else (dirname, basename)
+        )
+    for bucket in buckets:
+        bucket.sort(key=get_file_path)
+    return OrderedDict(zip(SLICE_NAMES, buckets))
+
+
+@single_flight
+def get_file_tokens_for_pkg(pkg_name):
     pkg_path = fetch_pkg(pkg_name)
     if pkg_path is None:
         return
-    files = get_dpkg_file_list(pkg_path)
-    files = split_dpkg_file_list(files)
-    return files
+    return parse_file_list(iter_dpkg_file_list(pkg_path))
 
 
-def parse_file_list(files: list[tuple[str]]) -> OrderedDict[str, list[tuple[str]]]:
-    slices = OrderedDict(
-        {"copyright": [], "config": [], "data": [], "lib": [], "bin": [], "rest": []}
-    )
-    files, rest = get_copyright_files(files)
-    slices["copyright"] = files
-    for file_type, (dirs, suffices) in FILE_TYPES.items():
-        files, rest = get_file_by_type(rest, dirs, suffices)
-        slices[file_type] = files
-    slices["rest"] = rest
-    return slices
+@single_flight
+def get_slice_presence(pkg_name) -> int:
+    """Returns a bitmap of the non-empty slices of a package
+
+    Bit `i` is set if the slice `SLICE_NAMES[i]` of the package has any files.
+    Packages that cannot be found have no slices. The slices of the packages
+    in `pkgs_to_slice` are parsed anyway and reused, for any other package
+    only the bitmap is computed and kept.
+    """
+    if pkg_name in pkgs_to_slice:
+        slices = get_file_tokens_for_pkg(pkg_name)
+        if slices is None:
+            return 0
+        return sum(1 << i for i, files in enumerate(slices.values()) if files)
 
+    pkg_path = fetch_pkg(pkg_name)
+    if pkg_path is None:
+        return 0
+    presence = 0
+    for index, *_ in iter_classified_files(iter_dpkg_file_list(pkg_path)):
+        presence |= 1 << index
+    return presence
 
-def get_file_tokens_for_pkg(pkg_name):
-    files = get_file_list_tokens(pkg_name)
-    if files is None:
-        return
-    files = filter_dpkg_file_list(files)
-    files = parse_file_list(files)
-    return files
 
+def prefetch_pkg(executor: ThreadPoolExecutor, pkg_name) -> Future:
+    """Fetches and parses a package to slice in the background
 
-def print_slice_files(pkg_name, files):
-    files = filter_dpkg_file_list(files)
-    print(f"Slicing files for package {pkg_name}\n")
-    print("COPYRIGHT FILES:")
-    files, rest = get_copyright_files(files)
-    pretty_print_files(files)
+    Once it is parsed, the slice presence of its dependencies, which its
+    essential slices are derived from, is computed in the background as well.
+    """
+
+    def prefetch():
+        slices = get_file_tokens_for_pkg(pkg_name)
+        if slices is not None:
+            for dep in find_depends(pkg_name):
+                executor.submit(get_slice_presence, dep)
+        return slices
 
-    # print files other than copyright
-    for file_type, (dirs, suffices) in FILE_TYPES.items():
-        files, rest = get_file_by_type(rest, dirs, suffices)
-        print(f"{file_type.upper()} FILES:")
-        pretty_print_files(files)
+    return executor.submit(prefetch)
 
-    print("REST FILES:")
-    pretty_print_files(rest)
 
-    return files
+def print_slice_files(pkg_name, slices):
+    print(f"Slicing files for package {pkg_name}\n")
+    for slice_name, files in slices.items():
+        print(f"{slice_name.upper()} FILES:")
+        pretty_print_files(files, already_sorted=True)
+
+    return slices
 
 
-def get_default_essential_slices(pkg_name: str, interdeps: list[str]) -> list[str]:
+@functools.lru_cache(maxsize=None)
+def get_default_essential_slices(pkg_name: str, interdeps: tuple[str]) -> list[str]:
     """Returns the default essential slices for a given slice
 
     Args:
         pkg_name (str): the package name
-        interdeps (list[str]): the list of interdependent slices
+        interdeps (tuple[str]): the interdependent slices
 
     Returns:
         list[str]: the list of essential slices
@@ -250,9 +557,10 @@ def get_default_essential_slices(pkg_name: str, interdeps: list[str]) -> list[st
     for dep in interdeps:
         # fill in the essential directive for the dependencies from other slices
         if dep.startswith("depends_"):
-            slice_name = dep.lstrip("depends_")
+            slice_name = dep.removeprefix("depends_")
+            slice_bit = 1 << SLICE_NAMES.index(slice_name)
             for dep_pkg in find_depends(pkg_name):
-                if get_file_tokens_for_pkg(dep_pkg)[slice_name]:
+                if get_slice_presence(dep_pkg) & slice_bit:
                     essential.append(f"{dep_pkg}_{slice_name}")
         else:  # fill in the essential directive for the dependencies from the same slice
             essential.append(f"{pkg_name}_{dep}")
@@ -264,15 +572,17 @@ def print_sdf_like_files(pkg_name, slices):
     if slices is None:
         return
     slices = {
-        k: {"contents": {" ".join(f).lstrip("."): None for f in v}}
+        k: {"contents": SliceContents(map(format_file, v))}
         for k, v in slices.items()
+        if v
     }
-    slices = {k: v for k, v in slices.items() if v["contents"]}
 
     # Add default slices `essential` to slices
     for slice, deps in INTERDEPENDENT_DEFAULT.items():
         if slice in slices:
-            slices[slice]["essential"] = get_default_essential_slices(pkg_name, deps)
+            slices[slice]["essential"] = get_default_essential_slices(
+                pkg_name, tuple(deps)
+            )
 
     sdf = OrderedDict([("package", pkg_name)])
 
@@ -281,38 +591,41 @@ def print_sdf_like_files(pkg_name, slices):
         sdf["essential"] = [f"{pkg_name}_copyright"]
 
     sdf["slices"] = slices
-
-    def represent_none(self, _):
-        return self.represent_scalar("tag:yaml.org,2002:null", "")
-
-    yaml.add_representer(type(None), represent_none)
-    yaml.add_representer(
-        OrderedDict,
-        lambda dumper, data: dumper.represent_mapping(
-            "tag:yaml.org,2002:map", data.items()
-        ),
-    )
     print(f"THE SDF-LIKE SLICE DEFINITION FOR {pkg_name}:")
     print("=====BEGIN=====")
     print(yaml.dump(sdf, Dumper=TopLevelEmptyLineDumper, sort_keys=False))
     print("======END======")
 
 
-def get_chisel_releases_pkgs(ubuntu_release=None) -> lsb_release:
+def get_chisel_releases_pkgs(ubuntu_release=None) -> frozenset[str]:
     if ubuntu_release is None:
         ubuntu_release = f"ubuntu-{lsb_release.get_distro_information()['RELEASE']}"
+    return list_chisel_releases_pkgs(ubuntu_release)
 
-    repo_path = os.path.join(temp_dir.name, "chisel-releases")
+
+@functools.lru_cache(maxsize=None)
+def list_chisel_releases_pkgs(ubuntu_release: str) -> frozenset[str]:
+    repo_path = os.path.join(get_temp_dir(), "chisel-releases", ubuntu_release)
+    # only the names of the slice definition files are needed, so fetch just
+    # the trees of the tip of the release branch, without any blobs, and list
+    # `slices/` from git instead of checking it out
     repo = git.Repo.clone_from(
-        "https://github.com/canonical/chisel-releases", repo_path
+        "https://github.com/canonical/chisel-releases",
+        repo_path,
+        multi_options=[
+            "--depth=1",
+            "--filter=blob:none",
+            "--no-checkout",
+            f"--branch={ubuntu_release}",
+        ],
     )
-    repo.git.checkout(ubuntu_release)
+    files = repo.git.ls_tree("--name-only", "HEAD", "slices/").splitlines()
 
-    pkgs = [
-        file.rstrip(".yaml")
-        for file in os.listdir(os.path.join(repo_path, "slices"))
+    pkgs = frozenset(
+        os.path.basename(file).removesuffix(".yaml")
+        for file in files
         if file.endswith(".yaml")
-    ]
+    )
 
     return pkgs
 
@@ -341,7 +654,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     if args.depends and not args.full_depends:
-        deps = find_depends(args.package)
+        deps = list(find_depends(args.package))
         print(deps)
 
     elif args.full_depends and not args.depends:
@@ -354,28 +667,53 @@ if __name__ == "__main__":
         sys.exit(1)
     deps.append(args.package)
 
-    chisel_releases_pkgs = get_chisel_releases_pkgs()
-    ubuntu_release = f"ubuntu-{lsb_release.get_distro_information()['RELEASE']}"
-
     if args.slice:
-        for i, pkg in enumerate(deps):
-            if not args.all and pkg in chisel_releases_pkgs:
-                print(
-                    f"Package {pkg} already sliced in chisel-releases for {ubuntu_release}"
-                )
-                continue
-            files = get_file_tokens_for_pkg(pkg)
-            # print(files)
-            print_sdf_like_files(pkg, files)
-            if len(deps) > 1:
-                if i == len(deps) - 1:
-                    break
-                key = input(
-                    f"Press ENTER to continue on {deps[i+1]}, 'q ENTER' to quit: "
-                )
-                if key == "":
+        chisel_releases_pkgs = get_chisel_releases_pkgs()
+        ubuntu_release = f"ubuntu-{lsb_release.get_distro_information()['RELEASE']}"
+
+        # fetch and parse the next few packages in the background while the
+        # current one is printed. Only a bounded number of packages is in
+        # flight, so quitting early leaves little work behind: the queued
+        # fetches are cancelled, but the interpreter still waits for the
+        # running ones before exiting.
+        pending = deque(
+            dict.fromkeys(
+                pkg for pkg in deps if args.all or pkg not in chisel_releases_pkgs
+            )
+        )
+        pkgs_to_slice = frozenset(pending)
+        executor = ThreadPoolExecutor(max_workers=FETCH_LOOKAHEAD)
+        futures = {}
+        try:
+            for i, pkg in enumerate(deps):
+                while pending and len(futures) < FETCH_LOOKAHEAD:
+                    next_pkg = pending.popleft()
+                    futures[next_pkg] = prefetch_pkg(executor, next_pkg)
+                if not args.all and pkg in chisel_releases_pkgs:
+                    print(
+                        f"Package {pkg} already sliced in chisel-releases for {ubuntu_release}"
+                    )
+                    continue
+                future = futures.pop(pkg, None)
+                if future is None:
+                    # listed more than once and already printed
                     continue
-                if key == "q":
+                files = future.result()
+                if files is None:
+                    print(f"Package {pkg} not found")
+                # print(files)
+                print_sdf_like_files(pkg, files)
+                if len(deps) > 1:
+                    if i == len(deps) - 1:
+                        break
+                    key = input(
+                        f"Press ENTER to continue on {deps[i+1]}, 'q ENTER' to quit: "
+                    )
+                    if key == "":
+                        continue
+                    if key == "q":
+                        break
+                    print("Invalid input")
                     break
-                print("Invalid input")
-                break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)